@@ -38,6 +38,26 @@ class GebetaGameState(BaseState):
         self.moves : list[str] = []
 
 
+    def __deepcopy__(self, memo: dict) -> 'GebetaGameState':
+        """
+        Copies the game state. take_action copies the state for every node of the search tree,
+        and copying the lists directly is much faster than the generic deepcopy.
+
+        Args:
+            memo (dict): The memo dictionary used by copy.deepcopy
+
+        Returns:
+            GebetaGameState: An independent copy of this game state
+        """
+        newState = GebetaGameState.__new__(GebetaGameState)
+        newState.board = self.board[:]
+        newState.playerindex = self.playerindex
+        newState.names = self.names[:]
+        newState.maximising = self.maximising
+        newState.moves = self.moves[:]
+        return newState
+
+
     # Auxiliary functions
     def home_to_move(self, home: str) -> int:
         """
@@ -277,7 +297,7 @@ class GebetaGameState(BaseState):
         Returns:
             bool: True if this state is a terminal state
         """
-        if len(self.moves) > 4:
+        if self.moves:  # A state that is set up from a position (e.g., by Gebeta_evaluate) can end after only a few moves
             return self.moves[-1] in ['A', 'B', 'D', 'T']
         return False
     
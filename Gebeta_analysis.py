@@ -2,7 +2,12 @@
 # Gebeta Game Tree Analysis
 
 # This script analyzes the game tree of the Gebeta game, a traditional board game played in Ethiopia.
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterable, Iterator
+
 import Gebeta_game
+import Gebeta_levels
 
 # Initialize global variables to track game statistics
 games : int = 0
@@ -40,55 +45,86 @@ def encode_status(status: list[int]) -> str:
     return "".join([chr(item + 65) for item in status])  # Convert the list into a string representation
 
 
-def apply_to_children(file1: str, file2, player: int) -> None:
+def apply_to_children(file1: str, file2, player: int, blocks: range | None = None) -> None:
     """
     Applies game moves to all children at a given level.
     The game states from the previous level are read from the file 'file1'.
     The new game states will be written to the file 'file2'.
     Files are used because there is so much data that it does not fit into RAM.
     The player who makes the next move is needed for the Gebeta-game class.
+    If 'file1' is a block-compressed level file, the work can be split by blocks.
 
     Args:
-        file1 (str): The file containing the current game states.
-        file2 (file_object): The file to write the new game states to.
+        file1 (str): The file containing the current game states (plain text or block-compressed).
+        file2 (file_object): The file to write the new game states to (a text file or a Gebeta_levels.LevelWriter).
         player (int): The current player (0 for Player A, 1 for Player B).
+        blocks (range | None): The blocks of 'file1' to read. The default is all blocks.
     """
     # The game statistics is stored in global variables
     global games, awins, bwins, draws, timeouts, turns, agency
 
-    with open(file1, "r") as file_object:  # Read the data from the previous level
-        for line in file_object:  # Yield a new line
-            status = line.strip()  # strip whitespace
-            for move in range(6):  # Make all possible moves
-                if player == 1:
-                    move = 5 - move  # Adjust the move for Player B
-                if status[move + player * 6] == "A":  # "A" represents 0
-                    continue # Try the next move if the pit is empty
-                new_status = decode_status(status)  # Create a decoded copy of the current status
-                new_game : Gebeta_game.Gebeta_game = Gebeta_game.Gebeta_game(new_status, player)  # Create a new game that starts at the curent status
-                if new_game.move(move):  # Apply the move
-                    agency += 1 if len([mov for mov in range(6) if new_game.board[mov + new_game.player * 6] > 0]) > 1 else 0  # Count the number of moves with agency (more than one valid move)
-                    turns += 1  # Count the number of turns
-                    print(encode_status(new_game.board), file=file2)  # Encode the new status and write it to 'file2'
-                else:  # new_game.move(move) returns False if the game was completed
-                    games += 1 # Increment the game count for each completed game
-                    match new_game.moves[-1]:  # Get the last character to determine the game outcome
-                        case "A": # Player A wins
-                            awins += 1  # Count the number of games that A wins
-                        case "B": # Player B wins
-                            bwins += 1  # Count the number of games that B wins
-                        case "D": # Draw
-                            draws += 1  # Count the number of games that end in a draw
-                        case "T": # Timeout due to an infinite loop
-                            timeouts += 1  # Count the number of games that end in an infinite loop
-
-
-def analyse_game_tree(depth: int) -> None:
+    for status in Gebeta_levels.read_positions(file1, blocks, workers=None):  # Read the data from the previous level
+        for move in range(6):  # Make all possible moves
+            if player == 1:
+                move = 5 - move  # Adjust the move for Player B
+            if status[move + player * 6] == "A":  # "A" represents 0
+                continue # Try the next move if the pit is empty
+            new_status = decode_status(status)  # Create a decoded copy of the current status
+            new_game : Gebeta_game.Gebeta_game = Gebeta_game.Gebeta_game(new_status, player)  # Create a new game that starts at the curent status
+            if new_game.move(move):  # Apply the move
+                agency += 1 if len([mov for mov in range(6) if new_game.board[mov + new_game.player * 6] > 0]) > 1 else 0  # Count the number of moves with agency (more than one valid move)
+                turns += 1  # Count the number of turns
+                file2.write(encode_status(new_game.board) + "\n")  # Encode the new status and write it to 'file2'
+            else:  # new_game.move(move) returns False if the game was completed
+                games += 1 # Increment the game count for each completed game
+                match new_game.moves[-1]:  # Get the last character to determine the game outcome
+                    case "A": # Player A wins
+                        awins += 1  # Count the number of games that A wins
+                    case "B": # Player B wins
+                        bwins += 1  # Count the number of games that B wins
+                    case "D": # Draw
+                        draws += 1  # Count the number of games that end in a draw
+                    case "T": # Timeout due to an infinite loop
+                        timeouts += 1  # Count the number of games that end in an infinite loop
+
+
+def level_file(level: int, compression: str | None) -> str:
+    """
+    Returns the name of the file that contains the game states of a level.
+
+    Args:
+        level (int): The level number
+        compression (str | None): "zlib" or "lzma" for a block-compressed file, or None for a plain text file
+
+    Returns:
+        str: The file name, e.g., 'level_3.gbz' or 'level_3.txt'
+    """
+    return f"level_{level}.gbz" if compression else f"level_{level}.txt"
+
+
+def open_level(level: int, compression: str | None):
+    """
+    Opens the file for the game states of a level for writing.
+
+    Args:
+        level (int): The level number
+        compression (str | None): "zlib" or "lzma" for a block-compressed file, or None for a plain text file
+
+    Returns:
+        file_object: A Gebeta_levels.LevelWriter or a text file
+    """
+    if compression:
+        return Gebeta_levels.LevelWriter(level_file(level, compression), compression)
+    return open(level_file(level, compression), "w")
+
+
+def analyse_game_tree(depth: int, compression: str | None = "zlib") -> None:
     """
     Analyzes the game tree of the Gebeta game.
 
     Args:
         depth (int): The depth of the game tree that shall be computed
+        compression (str | None): "zlib" or "lzma" to write block-compressed level files, or None to write plain text files
     """
     # The game statistics is stored in global variables
     global games, awins, bwins, draws, timeouts, turns, agency
@@ -97,18 +133,18 @@ def analyse_game_tree(depth: int) -> None:
         print("turns, level, games, agency, Awins, Bwins, draws, timeouts", file=f)  # Write header to CSV file
     
     # The root of the tree (level 0) is the initial game state before any move is made
-    file1 = "level_0.txt"
-    with open(file1, "w") as f:
-        print("EEEEEEEEEEEEAA", file=f)  # Write the initial game state to the file
+    file1 = level_file(0, compression)
+    with open_level(0, compression) as f:
+        f.write("EEEEEEEEEEEEAA\n")  # Write the initial game state to the file
 
     # Compute all nodes of all levels up to a given depth
     for level in range(depth):  # Apply moves to the first n levels of the game tree (n = depth)
-        with open(f"level_{level + 1}.txt", "w") as file2:  # Open the text file that shall contain the game states of the next level
+        with open_level(level + 1, compression) as file2:  # Open the text file that shall contain the game states of the next level
             print(f"Analyzing level {level + 1}...")  # Inform the user that the next level is in work
             player = level % 2  # The player who will make the next move (on level = 0, Player A (player = 0) makes the move on level + 1 = 1, and so on)
             apply_to_children(file1, file2, player)  # Apply moves to all children of the current level
             
-        file1 = f"level_{level + 1}.txt"  # Update the file name for the next level
+        file1 = level_file(level + 1, compression)  # Update the file name for the next level
 
         with open("results.csv", "a") as f:  # Write the game statistics from the computed level to the CSV file
             print(f"{turns}, {level + 1}, {games}, {agency}, {awins}, {bwins}, {draws}, {timeouts}", file=f)
@@ -116,5 +152,142 @@ def analyse_game_tree(depth: int) -> None:
         print(f"Level {level + 1}: {games} games ({games/turns:.1%}), {turns} turns, agency: {agency/turns:.1%}")
 
 
+
+# Depth-first analysis without level files
+STATISTICS : list[str] = ["turns", "games", "agency", "awins", "bwins", "draws", "timeouts"]  # The statistics counted per level
+OUTCOMES : dict[str, str] = {"A": "awins", "B": "bwins", "D": "draws", "T": "timeouts"}  # The statistic for each game outcome
+
+
+def new_counts(depth: int) -> dict[str, list[int]]:
+    """
+    Creates the counters of the depth-first analysis.
+
+    Args:
+        depth (int): The deepest level that is counted.
+
+    Returns:
+        dict[str, list[int]]: A list of zeros for the levels 0,..., depth for each statistic.
+    """
+    return {statistic: [0] * (depth + 1) for statistic in STATISTICS}
+
+
+def add_counts(counts: dict[str, list[int]], results: Iterable[dict[str, list[int]]]) -> None:
+    """
+    Adds the counts of walks through subtrees to 'counts'.
+
+    Args:
+        counts (dict[str, list[int]]): The counters to add to.
+        results (Iterable[dict[str, list[int]]]): The counts of the subtrees.
+    """
+    for result in results:
+        for statistic in STATISTICS:
+            counts[statistic] = [x + y for x, y in zip(counts[statistic], result[statistic])]
+
+
+def iterate_game_tree(status: str, level: int, depth: int, counts: dict[str, list[int]], frontier: bool = True) -> Iterator[str]:
+    """
+    Walks the game tree depth-first from a game state down to a given depth and adds the statistics of each level to 'counts'.
+    Instead of writing the levels to files, the walk keeps one board and one game for each level on an explicit stack,
+    and these buffers are reused for all nodes of the level. The memory use only grows with the depth.
+    The counts are per level, i.e., not accumulated as in 'results.csv'.
+
+    Args:
+        status (str): The encoded game state where the walk starts.
+        level (int): The level of this game state, which determines the player to move.
+        depth (int): The deepest level of the walk.
+        counts (dict[str, list[int]]): The counters for the levels 0,..., depth (see new_counts).
+        frontier (bool): If True, the game states on the deepest level are yielded, e.g., to split the walk across processes.
+
+    Yields:
+        str: The encoded game states on the deepest level, if frontier is True.
+    """
+    turns, agency, games = counts["turns"], counts["agency"], counts["games"]
+    # The board and the game of each level are reused for every node of the level
+    boards : list[list[int]] = [[0] * 14 for _ in range(depth + 1)]
+    stack : list[Gebeta_game.Gebeta_game] = [Gebeta_game.Gebeta_game(board, 0) for board in boards]
+    next_move : list[int] = [0] * (depth + 1)  # The next move to try on each level
+
+    boards[level][:] = decode_status(status)
+    current = level
+    while level <= current < depth:
+        move = next_move[current]
+        if move == 6:  # All moves of this node are done, go back to the parent
+            current -= 1
+            continue
+        next_move[current] = move + 1
+        player = current % 2  # The player who makes the next move
+        if player == 1:
+            move = 5 - move  # Adjust the move for Player B
+        parent = boards[current]
+        if parent[move + player * 6] == 0:
+            continue  # Try the next move if the pit is empty
+        child = current + 1
+        boards[child][:] = parent  # Copy the parent into the reused board of the child
+        new_game = stack[child]
+        new_game.player = player
+        new_game.moves = "S"
+        if new_game.move(move):  # Apply the move
+            agency[child] += 1 if len([mov for mov in range(6) if new_game.board[mov + new_game.player * 6] > 0]) > 1 else 0
+            turns[child] += 1
+            if child < depth:
+                next_move[child] = 0
+                current = child  # Continue with the children of the new node
+            elif frontier:
+                yield encode_status(new_game.board)
+        else:  # The game was completed
+            games[child] += 1
+            counts[OUTCOMES[new_game.moves[-1]]][child] += 1
+
+
+def walk_game_tree(status: str, level: int, depth: int) -> dict[str, list[int]]:
+    """
+    Counts the statistics of each level below a game state without writing any files.
+
+    Args:
+        status (str): The encoded game state where the walk starts.
+        level (int): The level of this game state.
+        depth (int): The deepest level of the walk.
+
+    Returns:
+        dict[str, list[int]]: The counts of each statistic for the levels 0,..., depth.
+    """
+    counts = new_counts(depth)
+    for _ in iterate_game_tree(status, level, depth, counts, frontier=False):
+        pass  # Nothing is yielded, the walk only counts
+    return counts
+
+
+def analyse_game_tree_dfs(depth: int, split: int = 3, workers: int | None = None) -> None:
+    """
+    Analyzes the game tree of the Gebeta game depth-first and writes the same 'results.csv' as analyse_game_tree,
+    but without writing the level files.
+    The first 'split' levels are walked in this process. The subtrees below the game states on level 'split'
+    are walked in a pool of processes.
+
+    Args:
+        depth (int): The depth of the game tree that shall be computed
+        split (int): The level where the walk is split across processes
+        workers (int | None): The number of worker processes. The default is the number of CPUs. With 1, no pool is used.
+    """
+    split = min(max(split, 1), depth)  # The first level is always walked in this process
+    counts = new_counts(depth)
+    # The root of the tree (level 0) is the initial game state. There are only a few game states on the first levels.
+    roots = list(iterate_game_tree("EEEEEEEEEEEEAA", 0, split, counts))
+    if workers == 1:
+        add_counts(counts, map(walk_game_tree, roots, repeat(split), repeat(depth)))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            add_counts(counts, pool.map(walk_game_tree, roots, repeat(split), repeat(depth)))
+
+    with open("results.csv", "w") as f:  # The game statistics will be written to a CSV file
+        print("turns, level, games, agency, Awins, Bwins, draws, timeouts", file=f)  # Write header to CSV file
+        totals = dict.fromkeys(STATISTICS, 0)
+        for level in range(1, depth + 1):
+            for statistic in STATISTICS:  # The CSV file contains the accumulated numbers
+                totals[statistic] += counts[statistic][level]
+            turns, games, agency = totals["turns"], totals["games"], totals["agency"]
+            print(f"{turns}, {level}, {games}, {agency}, {totals['awins']}, {totals['bwins']}, {totals['draws']}, {totals['timeouts']}", file=f)
+            print(f"Level {level}: {games} games ({games/turns:.1%}), {turns} turns, agency: {agency/turns:.1%}")
+
 if __name__ == "__main__":
     analyse_game_tree(17)  # Start the game analysis if this script is run directly
\ No newline at end of file
@@ -0,0 +1,507 @@
+#Gebeta_evaluate.py
+# Bulk evaluation of Gebeta positions
+
+# This script scores many positions in the letter format of Gebeta_analysis.encode_status, e.g., the lines of a level file.
+# The positions are streamed from a file or stdin and evaluated by a pool of processes.
+# The results are streamed back in input order, so the memory use does not depend on the size of the input.
+import argparse
+import sys
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from os import cpu_count
+from typing import Iterable, Iterator, NamedTuple, TextIO
+
+from mcts.searcher.mcts import MCTS
+
+import Gebeta_levels
+from Gebeta_analysis import decode_status
+from Gebeta_MCTS import Action, GebetaGameState
+
+ENGINES : list[str] = ["mcts", "depth", "tablebase"]  # The engines that can evaluate a position
+BUDGETS : dict[str, int] = {"mcts": 1500, "depth": 6, "tablebase": 200000}  # The default budget of each engine
+MAX_LETTER : str = chr(ord("A") + 48)  # The letter of a pit with all 48 seeds
+MAX_DEPTH : int = 64  # The deepest search of the "depth" engine, well below the recursion limit
+TABLEBASE_SIZE : int = 1 << 18  # The default maximum number of positions in the tablebase of a worker process, about 70 MiB
+
+_tablebase : OrderedDict[tuple[tuple[int, ...], int], int] = OrderedDict()  # The values of solved positions, the oldest first
+
+
+class Evaluation(NamedTuple):
+    """The evaluation of one position."""
+    status: str  # The encoded position
+    player: int  # The player to move (0 for Player A, 1 for Player B)
+    move: str  # The best home A-F for the player to move, or "-" if the player cannot move
+    value: float  # The expected number of families of the player to move minus the families of the opponent
+    visits: dict[str, int]  # The number of visits (MCTS), searched nodes (depth), or newly solved positions (tablebase) per home
+    error: str = ""  # The reason why the position could not be evaluated
+
+
+def check_position(status: str, player: int) -> str:
+    """
+    Checks that a position can be decoded and the player to move is valid.
+
+    Args:
+        status (str): The encoded game status string.
+        player (int): The player to move.
+
+    Returns:
+        str: The reason why the position is invalid, or an empty string if it is valid.
+    """
+    if len(status) != 14:
+        return f"Invalid position {status!r}: it must have 14 letters"
+    if any(not "A" <= char <= MAX_LETTER for char in status):
+        return f"Invalid position {status!r}: the letters must be A-{MAX_LETTER} (0-48 seeds)"
+    board = decode_status(status)
+    if sum(board[:12]) + 4 * (board[12] + board[13]) != 48:
+        return f"Invalid position {status!r}: the 48 seeds must be in the homes or in the stores as families"
+    if player not in (0, 1):
+        return f"Invalid player {player!r}: it must be 0 or 1"
+    return ""
+
+
+def position_to_state(status: str, player: int) -> GebetaGameState:
+    """
+    Creates a game state for the MCTS algorithm from an encoded position.
+    The player to move is the maximising player, so all values are seen from this player's perspective.
+
+    Args:
+        status (str): The encoded game status string, e.g., "EEEEEEEEEEEEAA".
+        player (int): The player to move (0 for Player A, 1 for Player B).
+
+    Returns:
+        GebetaGameState: The game state of the position.
+    """
+    if error := check_position(status, player):
+        raise ValueError(error)
+    state = GebetaGameState()
+    state.board = decode_status(status)
+    state.playerindex = player
+    state.maximising = player
+    return state
+
+
+def parse_positions(lines: Iterable[str], player: int = 0) -> Iterator[tuple[str, int]]:
+    """
+    Reads positions from lines of text. Each line contains an encoded position, optionally followed by the player to move.
+    Empty lines are skipped. Invalid lines are reported on stderr and skipped, so they do not stop a long run.
+    The lines are read lazily, so any number of lines can be processed.
+
+    Args:
+        lines (Iterable[str]): The lines to read, e.g., an open level file.
+        player (int): The player to move if a line does not name one.
+
+    Yields:
+        tuple[str, int]: The encoded position and the player to move.
+    """
+    for number, line in enumerate(lines, 1):
+        fields = line.split()
+        if not fields:
+            continue  # Skip empty lines
+        if len(fields) > 2 or (len(fields) == 2 and fields[1] not in ("0", "1")):
+            print(f"Skipping line {number}: expected a position and optionally the player 0 or 1, got {line.strip()!r}", file=sys.stderr)
+            continue
+        position = (fields[0], int(fields[1]) if len(fields) == 2 else player)
+        if error := check_position(*position):
+            print(f"Skipping line {number}: {error}", file=sys.stderr)
+            continue
+        yield position
+
+
+# Engines
+def _score(state: GebetaGameState, player: int) -> int:
+    """
+    Returns the number of families captured by the player minus the number of families captured by the opponent.
+    """
+    return state.board[12 + player] - state.board[13 - player]
+
+
+def _negamax(state: GebetaGameState, depth: int, alpha: float, beta: float, nodes: list[int]) -> float:
+    """
+    Searches the game tree to a given depth with alpha-beta pruning.
+
+    Args:
+        state (GebetaGameState): The state to search from. It must not be terminal.
+        depth (int): The number of remaining plies.
+        alpha (float): The lower bound of the search window.
+        beta (float): The upper bound of the search window.
+        nodes (list[int]): A one-element list that counts the searched nodes.
+
+    Returns:
+        float: The value of the state for the player to move.
+    """
+    nodes[0] += 1
+    if depth == 0:
+        return _score(state, state.playerindex)
+    for action in state.get_possible_actions():
+        child = state.take_action(action)
+        if child.is_terminal():  # The player to move does not change at the end of the game
+            value = _score(child, state.playerindex)
+        else:
+            value = -_negamax(child, depth - 1, -beta, -alpha, nodes)
+        if value > alpha:
+            alpha = value
+            if alpha >= beta:
+                break  # The opponent will avoid this state
+    return alpha
+
+
+Position = tuple[tuple[int, ...], int]  # A game board and the player to move
+
+
+def _attractor(layer: list[Position], exits: dict, moves: dict, parents: dict, player: int, good) -> set[Position]:
+    """
+    Computes the positions of a layer from which a player can force the game to leave the layer with a good value.
+
+    Args:
+        layer (list[Position]): The positions of the layer.
+        exits (dict): The values (for Player A) of the moves of each position that leave the layer.
+        moves (dict): The positions in the layer that each position can move to.
+        parents (dict): The positions in the layer that can move to each position, once per move.
+        player (int): The player who forces the game.
+        good (Callable[[int], bool]): Checks if a value is good for the player.
+
+    Returns:
+        set[Position]: The positions from which the player can force a good value.
+    """
+    attractor : set[Position] = set()
+    remaining : dict[Position, int] = {}  # The number of moves of the opponent that do not lead to a good value yet
+    work : list[Position] = []
+    for position in layer:
+        if position[1] == player:
+            if any(good(value) for value in exits[position]):
+                attractor.add(position)
+                work.append(position)
+        else:
+            remaining[position] = sum(not good(value) for value in exits[position]) + len(moves[position])
+            if remaining[position] == 0:
+                attractor.add(position)
+                work.append(position)
+    while work:
+        for parent in parents[work.pop()]:
+            if parent in attractor:
+                continue
+            if parent[1] != player:
+                remaining[parent] -= 1
+                if remaining[parent] > 0:
+                    continue
+            attractor.add(parent)
+            work.append(parent)
+    return attractor
+
+
+def _solve(board: tuple[int, ...], player: int, nodes: list[int], limit: int, size: int = TABLEBASE_SIZE) -> int:
+    """
+    Computes the exact value of a position by retrograde analysis of all positions that can be reached from it.
+    A capture never returns, so the positions are solved in layers of equal stores, starting with the most families captured.
+    Within a layer, no family is captured, so sowing can go round in circles. A game that never leaves the layer
+    is scored by the families captured so far. The values do not depend on how a position is reached,
+    so they are kept in a bounded dictionary, which serves as a tablebase that is built while positions are evaluated.
+
+    Args:
+        board (tuple[int, ...]): The game board.
+        player (int): The player to move.
+        nodes (list[int]): A one-element list that counts the searched nodes.
+        limit (int): The maximum number of searched nodes.
+        size (int): The maximum number of positions in the tablebase. 0 turns the tablebase off.
+
+    Returns:
+        int: The value of the position for the player to move.
+    """
+    root = (board, player)
+    if root in _tablebase:
+        return _tablebase[root]
+
+    # Find all positions that can be reached and are not in the tablebase yet
+    exits : dict[Position, list[int]] = {}  # The values for Player A of the moves that end the game or reach a solved position
+    children : dict[Position, list[Position]] = {}  # The positions that the moves reach
+    queue : deque[Position] = deque([root])
+    while queue:
+        position = queue.popleft()
+        if position in exits:
+            continue
+        if nodes[0] >= limit:
+            raise ValueError(f"The tablebase search needs more than {limit} nodes")
+        nodes[0] += 1
+        state = GebetaGameState()
+        state.board = list(position[0])
+        state.playerindex = position[1]
+        exits[position], children[position] = [], []
+        for action in state.get_possible_actions():
+            child = state.take_action(action)
+            child_position = (tuple(child.board), child.playerindex)
+            if child.is_terminal():
+                exits[position].append(_score(child, 0))
+            elif child_position in _tablebase:
+                exits[position].append(_tablebase[child_position] * (1 - 2 * child.playerindex))
+            else:
+                children[position].append(child_position)
+                queue.append(child_position)
+
+    # Solve the layers, starting with the most families captured
+    layers : dict[tuple[int, int], list[Position]] = {}
+    for position in exits:
+        layers.setdefault(position[0][12:], []).append(position)
+    values : dict[Position, int] = {}  # The values for Player A
+    for stores in sorted(layers, key=sum, reverse=True):
+        layer = layers[stores]
+        staying = stores[0] - stores[1]  # The value of a game that never leaves the layer
+        moves : dict[Position, list[Position]] = {position: [] for position in layer}
+        parents : dict[Position, list[Position]] = {position: [] for position in layer}
+        for position in layer:
+            for child in children[position]:
+                if child in moves:
+                    moves[position].append(child)
+                    parents[child].append(position)
+                else:  # The move captures a family, so the child is in a solved layer
+                    exits[position].append(values[child])
+        candidates = sorted({value for position in layer for value in exits[position]} | {staying})
+        for position in layer:
+            values[position] = candidates[0]
+        for threshold in candidates[1:]:  # Player A can force at least the threshold from these positions
+            if staying >= threshold:
+                bad = _attractor(layer, exits, moves, parents, 1, lambda value: value < threshold)
+                winning = [position for position in layer if position not in bad]
+            else:
+                winning = _attractor(layer, exits, moves, parents, 0, lambda value: value >= threshold)
+            for position in winning:
+                values[position] = threshold
+
+    if size > 0:
+        for position, value in values.items():
+            while len(_tablebase) >= size:  # Keep the memory use bounded by removing the oldest positions
+                _tablebase.popitem(last=False)
+            _tablebase[position] = value * (1 - 2 * position[1])  # The tablebase holds the values for the player to move
+    return values[root] * (1 - 2 * player)
+
+
+def evaluate_position(status: str, player: int, engine: str = "mcts", budget: int | None = None,
+                      tablebase_size: int = TABLEBASE_SIZE) -> Evaluation:
+    """
+    Evaluates one position with the chosen engine.
+
+    Args:
+        status (str): The encoded position.
+        player (int): The player to move (0 for Player A, 1 for Player B).
+        engine (str): "mcts", "depth", or "tablebase".
+        budget (int | None): The time limit in milliseconds for "mcts", the search depth in plies for "depth",
+            or the maximum number of searched nodes for "tablebase". The default depends on the engine (see BUDGETS).
+        tablebase_size (int): The maximum number of solved positions that "tablebase" keeps in this process. 0 turns the table off.
+
+    Returns:
+        Evaluation: The best move, its value, and the visits per move.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine!r}")
+    budget = BUDGETS[engine] if budget is None else budget
+    check_budget(engine, budget)
+    check_tablebase_size(tablebase_size)
+    state = position_to_state(status, player)
+    actions = state.get_possible_actions()
+    if not actions:  # The player to move cannot move, so the game is already over
+        return Evaluation(status, player, "-", float(_score(state, player)), {})
+
+    if engine == "mcts":
+        searcher = MCTS(time_limit=budget)
+        action, value = searcher.search(initial_state=state, need_details=True)
+        visits = {str(move): node.numVisits for move, node in searcher.root.children.items()}
+        return Evaluation(status, player, str(action), value, visits)
+
+    best : tuple[float, Action] | None = None
+    visits = {}
+    for action in actions:
+        child = state.take_action(action)
+        nodes = [1]
+        if child.is_terminal():
+            value = _score(child, player)
+        elif engine == "depth":
+            value = -_negamax(child, budget - 1, float("-inf"), float("inf"), nodes)
+        else:
+            value = -_solve(tuple(child.board), child.playerindex, nodes, budget - sum(visits.values()), tablebase_size)
+        visits[str(action)] = nodes[0]
+        if best is None or value > best[0]:
+            best = (value, action)
+    return Evaluation(status, player, str(best[1]), float(best[0]), visits)
+
+
+def check_budget(engine: str, budget: int) -> None:
+    """
+    Checks that the budget is valid for the engine.
+
+    Args:
+        engine (str): "mcts", "depth", or "tablebase".
+        budget (int): The budget of the engine.
+    """
+    if budget < 1:
+        raise ValueError(f"The budget must be at least 1, not {budget}")
+    if engine == "depth" and budget > MAX_DEPTH:
+        raise ValueError(f"The search depth must be at most {MAX_DEPTH} plies, not {budget}")
+
+
+def check_tablebase_size(tablebase_size: int) -> None:
+    """
+    Checks that the size of the tablebase is valid.
+
+    Args:
+        tablebase_size (int): The maximum number of positions in the tablebase of a worker process.
+    """
+    if tablebase_size < 0:
+        raise ValueError(f"The tablebase size must be at least 0, not {tablebase_size}")
+
+
+def check_pool(workers: int | None, chunksize: int, max_inflight: int | None = None) -> None:
+    """
+    Checks that the settings of the process pool are valid. None means the default.
+
+    Args:
+        workers (int | None): The number of worker processes.
+        chunksize (int): The number of positions that are sent to a worker at once.
+        max_inflight (int | None): The maximum number of chunks in the pool.
+    """
+    if workers is not None and workers < 1:
+        raise ValueError(f"The number of workers must be at least 1, not {workers}")
+    if chunksize < 1:
+        raise ValueError(f"The chunk size must be at least 1, not {chunksize}")
+    if max_inflight is not None and max_inflight < 1:
+        raise ValueError(f"The number of chunks in the pool must be at least 1, not {max_inflight}")
+
+
+# Parallel evaluation
+def _evaluate_chunk(chunk: list[tuple[str, int]], engine: str, budget: int | None, tablebase_size: int) -> list[Evaluation]:
+    """
+    Evaluates a chunk of positions in a worker process.
+    A position that cannot be evaluated is reported in its evaluation, so the other positions are still evaluated.
+    """
+    evaluations : list[Evaluation] = []
+    for status, player in chunk:
+        try:
+            evaluations.append(evaluate_position(status, player, engine, budget, tablebase_size))
+        except Exception as error:
+            evaluations.append(Evaluation(status, player, "-", float("nan"), {}, str(error)))
+    return evaluations
+
+
+def evaluate_positions(positions: Iterable[tuple[str, int]], engine: str = "mcts", budget: int | None = None, workers: int | None = None,
+                       chunksize: int = 16, max_inflight: int | None = None, tablebase_size: int = TABLEBASE_SIZE) -> Iterator[Evaluation]:
+    """
+    Evaluates positions in a pool of processes and yields the evaluations in input order.
+    The positions are sent to the pool in chunks. At most max_inflight chunks are submitted at any time,
+    so the positions are read only as fast as they are evaluated and the memory use stays flat.
+
+    Args:
+        positions (Iterable[tuple[str, int]]): The encoded positions and the players to move, e.g., from parse_positions.
+        engine (str): "mcts", "depth", or "tablebase".
+        budget (int | None): The time limit in milliseconds for "mcts", the search depth in plies for "depth",
+            or the maximum number of searched nodes per position for "tablebase". The default depends on the engine (see BUDGETS).
+        workers (int | None): The number of worker processes. The default is the number of CPUs.
+        chunksize (int): The number of positions that are sent to a worker at once.
+        max_inflight (int | None): The maximum number of chunks in the pool. The default is twice the number of workers.
+        tablebase_size (int): The maximum number of solved positions that "tablebase" keeps in each worker process.
+
+    Yields:
+        Evaluation: The evaluation of each position.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine!r}")
+    budget = BUDGETS[engine] if budget is None else budget
+    check_budget(engine, budget)
+    check_tablebase_size(tablebase_size)
+    check_pool(workers, chunksize, max_inflight)
+    workers = workers or cpu_count() or 1
+    max_inflight = max_inflight or 2 * workers
+    inflight : deque[Future] = deque()  # The submitted chunks in input order
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunk : list[tuple[str, int]] = []
+        for position in positions:
+            chunk.append(position)
+            if len(chunk) == chunksize:
+                if len(inflight) == max_inflight:  # Wait for the oldest chunk before reading more positions
+                    yield from inflight.popleft().result()
+                inflight.append(pool.submit(_evaluate_chunk, chunk, engine, budget, tablebase_size))
+                chunk = []
+        if chunk:
+            inflight.append(pool.submit(_evaluate_chunk, chunk, engine, budget, tablebase_size))
+        while inflight:
+            yield from inflight.popleft().result()
+
+
+def format_evaluation(evaluation: Evaluation) -> str:
+    """
+    Formats an evaluation as a line of the CSV output.
+
+    Args:
+        evaluation (Evaluation): The evaluation to format.
+
+    Returns:
+        str: The CSV line without a line break.
+    """
+    visits = " ".join(f"{home}:{count}" for home, count in sorted(evaluation.visits.items()))
+    return f"{evaluation.status}, {evaluation.player}, {evaluation.move}, {evaluation.value:.3f}, {visits}, {evaluation.error}"
+
+
+def evaluate_file(file_in: Iterable[str], file_out: TextIO, player: int = 0, engine: str = "mcts", budget: int | None = None,
+                  workers: int | None = None, chunksize: int = 16, tablebase_size: int = TABLEBASE_SIZE) -> None:
+    """
+    Evaluates all positions of a file and writes the results as CSV.
+
+    Args:
+        file_in (file_object): The file with one position per line, or the game states of a block-compressed level file.
+        file_out (file_object): The file to write the results to.
+        player (int): The player to move if a line does not name one. For the file level_n.txt, this is n % 2.
+        engine (str): "mcts", "depth", or "tablebase".
+        budget (int | None): The time limit in milliseconds for "mcts", the search depth in plies for "depth",
+            or the maximum number of searched nodes per position for "tablebase". The default depends on the engine (see BUDGETS).
+        workers (int | None): The number of worker processes. The default is the number of CPUs.
+        chunksize (int): The number of positions that are sent to a worker at once.
+        tablebase_size (int): The maximum number of solved positions that "tablebase" keeps in each worker process.
+    """
+    print("status, player, move, value, visits, error", file=file_out)  # Write header
+    for evaluation in evaluate_positions(parse_positions(file_in, player), engine, budget, workers, chunksize,
+                                             tablebase_size=tablebase_size):
+        print(format_evaluation(evaluation), file=file_out)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Command line interface for the bulk evaluation.
+
+    Args:
+        argv (list[str] | None): The command line arguments. The default is sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser(description="Evaluate Gebeta positions in parallel.")
+    parser.add_argument("input", nargs="?", default="-", help="level file (plain text or block-compressed), or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="CSV file to write the results to, or - for stdout")
+    parser.add_argument("-p", "--player", type=int, choices=[0, 1], default=0, help="player to move if a line does not name one")
+    parser.add_argument("-e", "--engine", choices=ENGINES, default="mcts", help="engine that evaluates the positions")
+    parser.add_argument("-b", "--budget", type=int, default=None,
+                        help=f"time limit in ms (mcts, default {BUDGETS['mcts']}), search depth in plies (depth, default {BUDGETS['depth']}), "
+                             f"or maximum number of searched nodes per position (tablebase, default {BUDGETS['tablebase']})")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("-c", "--chunksize", type=int, default=16, help="number of positions sent to a worker at once")
+    parser.add_argument("-t", "--tablebase-size", type=int, default=TABLEBASE_SIZE,
+                        help=f"maximum number of solved positions kept by each worker for the tablebase engine, about 270 bytes each, "
+                             f"0 to keep none (default {TABLEBASE_SIZE})")
+    args = parser.parse_args(argv)
+    try:
+        if args.budget is not None:
+            check_budget(args.engine, args.budget)
+        check_tablebase_size(args.tablebase_size)
+        check_pool(args.workers, args.chunksize)
+    except ValueError as error:
+        parser.error(str(error))
+
+    file_out = sys.stdout if args.output == "-" else open(args.output, "w")
+    file_in : Iterable[str] = sys.stdin
+    try:
+        if args.input != "-":  # Block-compressed level files are decompressed by one thread per CPU
+            file_in = Gebeta_levels.read_positions(args.input, workers=None) if Gebeta_levels.is_level_file(args.input) else open(args.input, "r")
+        evaluate_file(file_in, file_out, args.player, args.engine, args.budget, args.workers, args.chunksize, args.tablebase_size)
+    finally:
+        if hasattr(file_in, "close") and file_in is not sys.stdin:
+            file_in.close()
+        if file_out is not sys.stdout:
+            file_out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+#Gebeta_levels.py
+# Block-compressed level files
+
+# The level files of the game tree analysis contain billions of game states.
+# A level file is written as a sequence of independently compressed blocks, followed by an index of the blocks:
+#   header:  b"GBZ1" and one byte for the compression ("z" for zlib, "x" for lzma)
+#   blocks:  each block holds up to block_size game states, one per line as in the plain text files
+#   index:   for each block, its offset, its compressed size, and its number of game states
+#   trailer: the offset of the index, the number of blocks, and b"GBZ1"
+# Readers can seek to any block, decompress blocks in parallel, and split the work by blocks without scanning the file.
+import lzma
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import cpu_count
+from typing import Iterator
+
+MAGIC : bytes = b"GBZ1"  # Marks a block-compressed level file
+COMPRESSIONS : dict[str, bytes] = {"zlib": b"z", "lzma": b"x"}  # The supported compressions and their codes in the header
+HEADER = struct.Struct("<4sc")  # Magic and compression code
+ENTRY = struct.Struct("<QII")  # Offset, compressed size, and number of game states of a block
+TRAILER = struct.Struct("<QI4s")  # Offset of the index, number of blocks, and magic
+
+
+def _compress(data: bytes, code: bytes) -> bytes:
+    """
+    Compresses a block with the compression given by its code.
+    """
+    return zlib.compress(data, 1) if code == b"z" else lzma.compress(data)  # The fastest zlib level, which is almost as small as the default level
+
+
+def _decompress(data: bytes, code: bytes) -> bytes:
+    """
+    Decompresses a block with the compression given by its code.
+    """
+    return zlib.decompress(data) if code == b"z" else lzma.decompress(data)
+
+
+def is_level_file(filename: str) -> bool:
+    """
+    Checks if a file is a block-compressed level file.
+
+    Args:
+        filename (str): The name of the file.
+
+    Returns:
+        bool: True if the file starts with the header of a block-compressed level file.
+    """
+    with open(filename, "rb") as file_object:
+        return file_object.read(len(MAGIC)) == MAGIC
+
+
+class LevelWriter:
+    """
+    Writes game states to a block-compressed level file.
+    The writer can be used like a text file, e.g., writer.write(status + "\n"), and must be closed to write the index.
+    The blocks are compressed in a background thread while the next block is filled. zlib and lzma release the GIL.
+    """
+    def __init__(self, filename: str, compression: str = "zlib", block_size: int = 65536) -> None:
+        """
+        Create a new level file.
+
+        Args:
+            filename (str): The name of the file.
+            compression (str): "zlib" or "lzma".
+            block_size (int): The number of game states per block.
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression!r}")
+        self.code : bytes = COMPRESSIONS[compression]
+        self.block_size : int = block_size
+        self.file_object = open(filename, "wb")
+        self.file_object.write(HEADER.pack(MAGIC, self.code))
+        self.index : list[tuple[int, int, int]] = []  # Offset, compressed size, and number of game states of each block
+        self.buffer : list[str] = []  # The text of the current block
+        self.count : int = 0  # The number of game states in the current block
+        self.compressor : ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1)
+        self.pending : deque[tuple[Future, int]] = deque()  # The blocks in compression and their numbers of game states
+
+
+    def write(self, text: str) -> None:
+        """
+        Writes text that contains complete lines of game states, e.g., one game state followed by a line break.
+        A block is only completed after a line break, so a game state is never split between two blocks.
+
+        Args:
+            text (str): The text to write.
+        """
+        self.buffer.append(text)
+        self.count += text.count("\n")
+        if self.count >= self.block_size and text.endswith("\n"):
+            self.flush()
+
+
+    def flush(self) -> None:
+        """
+        Hands the current block to the background thread for compression.
+        The compressed blocks are written in order. At most two blocks wait for compression to keep the memory use bounded.
+        """
+        if not self.buffer:
+            return
+        data = "".join(self.buffer).encode("ascii")
+        self.pending.append((self.compressor.submit(_compress, data, self.code), self.count))
+        self.buffer = []
+        self.count = 0
+        while len(self.pending) > 2:
+            self._write_block()
+
+
+    def _write_block(self) -> None:
+        """
+        Waits for the oldest block in compression and writes it to the file.
+        """
+        future, count = self.pending.popleft()
+        data = future.result()
+        self.index.append((self.file_object.tell(), len(data), count))
+        self.file_object.write(data)
+
+
+    def close(self) -> None:
+        """
+        Writes the last block, the index, and the trailer, and closes the file.
+        """
+        if self.file_object.closed:
+            return
+        self.flush()
+        while self.pending:
+            self._write_block()
+        self.compressor.shutdown()
+        index_offset = self.file_object.tell()
+        for entry in self.index:
+            self.file_object.write(ENTRY.pack(*entry))
+        self.file_object.write(TRAILER.pack(index_offset, len(self.index), MAGIC))
+        self.file_object.close()
+
+
+    def __enter__(self) -> 'LevelWriter':
+        return self
+
+
+    def abort(self) -> None:
+        """
+        Closes the file without the index and the trailer, so that LevelReader rejects it as incomplete.
+        """
+        self.compressor.shutdown(cancel_futures=True)
+        self.file_object.close()
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:  # Do not mark a file as complete if writing it failed
+            self.abort()
+
+
+class LevelReader:
+    """
+    Reads game states from a block-compressed level file.
+    """
+    def __init__(self, filename: str) -> None:
+        """
+        Open a level file and read its index.
+
+        Args:
+            filename (str): The name of the file.
+        """
+        self.filename : str = filename
+        with open(filename, "rb") as file_object:
+            magic, self.code = HEADER.unpack(file_object.read(HEADER.size))
+            size = file_object.seek(0, 2)
+            if size < HEADER.size + TRAILER.size:
+                raise ValueError(f"{filename} is not a complete block-compressed level file")
+            file_object.seek(size - TRAILER.size)  # The trailer is at the end of the file
+            index_offset, blocks, trailer_magic = TRAILER.unpack(file_object.read(TRAILER.size))
+            if magic != MAGIC or trailer_magic != MAGIC:
+                raise ValueError(f"{filename} is not a complete block-compressed level file")
+            file_object.seek(index_offset)
+            data = file_object.read(blocks * ENTRY.size)
+        self.index : list[tuple[int, int, int]] = list(ENTRY.iter_unpack(data))  # Offset, compressed size, and number of game states of each block
+
+
+    def __len__(self) -> int:
+        """
+        Returns the number of blocks.
+        """
+        return len(self.index)
+
+
+    def count(self) -> int:
+        """
+        Returns the number of game states in the file without reading the blocks.
+        """
+        return sum(entry[2] for entry in self.index)
+
+
+    def read_block(self, block: int) -> list[str]:
+        """
+        Reads and decompresses one block. Each call opens the file, so blocks can be read by several threads at once.
+
+        Args:
+            block (int): The number of the block.
+
+        Returns:
+            list[str]: The game states in the block.
+        """
+        offset, size, _ = self.index[block]
+        with open(self.filename, "rb") as file_object:
+            file_object.seek(offset)
+            data = file_object.read(size)
+        return _decompress(data, self.code).decode("ascii").split()
+
+
+    def positions(self, blocks: range | None = None, workers: int = 1) -> Iterator[str]:
+        """
+        Yields the game states of a range of blocks in file order.
+        With more than one worker, the next blocks are decompressed in a thread pool while the current block is processed.
+        zlib and lzma release the GIL, so the decompression runs in parallel.
+
+        Args:
+            blocks (range | None): The blocks to read. The default is all blocks.
+            workers (int): The number of threads that decompress blocks.
+
+        Yields:
+            str: The encoded game states.
+        """
+        blocks = range(len(self.index)) if blocks is None else blocks
+        if workers <= 1:
+            for block in blocks:
+                yield from self.read_block(block)
+            return
+        inflight : deque[Future] = deque()  # The blocks in decompression in file order
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for block in blocks:
+                if len(inflight) == 2 * workers:  # Only keep a few blocks in memory
+                    yield from inflight.popleft().result()
+                inflight.append(pool.submit(self.read_block, block))
+            while inflight:
+                yield from inflight.popleft().result()
+
+
+def read_positions(filename: str, blocks: range | None = None, workers: int | None = 1) -> Iterator[str]:
+    """
+    Yields the game states of a level file, which can be a block-compressed or a plain text file.
+
+    Args:
+        filename (str): The name of the file.
+        blocks (range | None): The blocks to read from a block-compressed file. The default is all blocks.
+            A plain text file has only one block.
+        workers (int | None): The number of threads that decompress blocks. None means the number of CPUs.
+
+    Yields:
+        str: The encoded game states.
+    """
+    if is_level_file(filename):
+        yield from LevelReader(filename).positions(blocks, workers or cpu_count() or 1)
+    elif blocks is None or 0 in blocks:
+        with open(filename, "r") as file_object:
+            for line in file_object:
+                if status := line.strip():
+                    yield status
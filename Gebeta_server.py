@@ -0,0 +1,419 @@
+#Gebeta_server.py
+# Server for many concurrent Gebeta games against the computer
+
+# Each connection is one player who plays games against the computer with a simple line protocol.
+# The computer's moves are searched by a shared pool of worker processes, so one game's search does not block the others.
+#
+# Commands (one per line, case-insensitive):
+#   NEW [A|B] [ms]  Start a new game. The player plays A (moves first, default) or B. The computer may search ms milliseconds per move.
+#   MOVE <home>     Sow from the home A-F of the player.
+#   BOARD           Show the current game state.
+#   STATS           Show the latency of the computer's moves in this session and the depth of the search queue.
+#   QUIT            Close the connection.
+# Responses:
+#   STATE <status> <player to move> <families A> <families B>
+#   COMPUTER <home> <latency in ms>
+#   END <A|B|D|T>   The winner, a draw, or a timeout
+#   STATS moves=<n> mean_ms=<ms> max_ms=<ms> queue=<n> sessions=<n>
+#   OK <text> | ERR <text>
+import argparse
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+
+from Gebeta_analysis import encode_status
+from Gebeta_evaluate import evaluate_position
+from Gebeta_MCTS import Action, GebetaGameState
+
+
+def search_move(status: str, player: int, budget: int) -> str:
+    """
+    Searches the computer's move with MCTS in a worker process.
+
+    Args:
+        status (str): The encoded game state.
+        player (int): The player to move, i.e., the computer.
+        budget (int): The time limit of the search in milliseconds.
+
+    Returns:
+        str: The home A-F of the best move.
+    """
+    return evaluate_position(status, player, "mcts", budget).move
+
+
+class EnginePool:
+    """
+    A shared pool of search workers.
+    The requests wait in one FIFO queue, and each worker takes the next request when its search is done.
+    A game has at most one request in the queue, so the games are served in turn.
+    """
+    def __init__(self, workers: int | None = None) -> None:
+        """
+        Create the pool.
+
+        Args:
+            workers (int | None): The number of worker processes. The default is the number of CPUs.
+        """
+        self.workers : int = workers or cpu_count() or 1
+        self.executor : ProcessPoolExecutor | None = None
+        self.queue : asyncio.Queue = asyncio.Queue()  # Requests (status, player, budget, future) that wait for a worker
+        self.tasks : list[asyncio.Task] = []
+
+
+    def start(self) -> None:
+        """
+        Start the worker processes and one dispatcher task per worker.
+        """
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        # Start the processes before any connection is accepted, so that they do not inherit the sockets of the players.
+        # Otherwise a closed connection stays open in the workers, and neither side notices the end of the connection.
+        for future in [self.executor.submit(int) for _ in range(self.workers)]:
+            future.result()
+        self.tasks = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+
+
+    async def stop(self) -> None:
+        """
+        Stop the dispatcher tasks and the worker processes.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(cancel_futures=True)
+
+
+    async def dispatch(self) -> None:
+        """
+        Pass the requests from the queue to a worker process, one at a time.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            status, player, budget, future = await self.queue.get()
+            if future.cancelled():  # The player has left, so the search is not needed
+                self.queue.task_done()
+                continue
+            try:
+                move = await loop.run_in_executor(self.executor, search_move, status, player, budget)
+                if not future.done():  # The player may have left
+                    future.set_result(move)
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            finally:
+                self.queue.task_done()
+
+
+    def search(self, status: str, player: int, budget: int) -> asyncio.Future:
+        """
+        Queue a search. The search is skipped if the returned future is cancelled before a worker takes it.
+
+        Args:
+            status (str): The encoded game state.
+            player (int): The player to move, i.e., the computer.
+            budget (int): The time limit of the search in milliseconds.
+
+        Returns:
+            asyncio.Future: The future of the home A-F of the best move.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((status, player, budget, future))
+        return future
+
+
+class Session:
+    """
+    A connection of one player who plays games against the computer.
+    """
+    def __init__(self, server: 'GebetaServer', reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Create a session.
+
+        Args:
+            server (GebetaServer): The server that hosts the session.
+            reader (asyncio.StreamReader): The stream to read commands from.
+            writer (asyncio.StreamWriter): The stream to write responses to.
+        """
+        self.server : GebetaServer = server
+        self.reader : asyncio.StreamReader = reader
+        self.writer : asyncio.StreamWriter = writer
+        self.game : GebetaGameState | None = None
+        self.computer : int = 1  # The index of the computer player
+        self.budget : int = server.budget  # The time limit of the computer's search in milliseconds
+        self.commands : asyncio.Queue = asyncio.Queue(maxsize=16)  # The commands that are read but not handled yet, None at the end
+        self.pending : asyncio.Future | None = None  # The computer's search that the session waits for
+        self.closed : bool = False  # True when the player has disconnected
+        # Latency of the computer's moves, from the request until the move is sent
+        self.moves : int = 0
+        self.total_latency : float = 0.0
+        self.max_latency : float = 0.0
+
+
+    def send(self, line: str) -> None:
+        """
+        Send one line to the player.
+        """
+        self.writer.write((line + "\n").encode())
+
+
+    def send_state(self) -> None:
+        """
+        Send the current game state to the player.
+        """
+        board = self.game.board
+        self.send(f"STATE {encode_status(board)} {self.game.names[self.game.playerindex]} {board[12]} {board[13]}")
+
+
+    async def read_commands(self) -> None:
+        """
+        Read commands while the session handles earlier commands or waits for the computer.
+        This notices at once when the player disconnects, so that the computer's pending search can be cancelled.
+        """
+        try:
+            while line := await self.reader.readline():
+                await self.commands.put(line)
+        except (ConnectionError, ValueError):
+            pass  # The connection was lost or the line was too long
+        self.close()
+        await self.commands.put(None)
+
+
+    def close(self) -> None:
+        """
+        Mark the session as closed and cancel the computer's pending search.
+        """
+        self.closed = True
+        if self.pending is not None:
+            self.pending.cancel()
+
+
+    async def run(self) -> None:
+        """
+        Read and handle commands until the player quits or disconnects.
+        """
+        self.send("OK Gebeta server. Commands: NEW [A|B] [ms], MOVE <home>, BOARD, STATS, QUIT")
+        reader = asyncio.create_task(self.read_commands())
+        try:
+            await self.handle_commands()
+        finally:
+            reader.cancel()
+            self.close()
+
+
+    async def handle_commands(self) -> None:
+        """
+        Handle the commands until the player quits or disconnects.
+        """
+        while line := await self.commands.get():
+            command, *args = line.decode(errors="replace").upper().split() or [""]
+            try:
+                match command:
+                    case "NEW":
+                        await self.new_game(args)
+                    case "MOVE":
+                        await self.move(args)
+                    case "BOARD":
+                        if self.game:
+                            self.send_state()
+                        else:
+                            self.send("ERR No game. Use NEW to start a game.")
+                    case "STATS":
+                        self.send_stats()
+                    case "QUIT":
+                        self.send("OK Bye")
+                        break
+                    case "":
+                        pass
+                    case _:
+                        self.send(f"ERR Unknown command {command}")
+            except ConnectionError:
+                raise  # The player disconnected, which ends the session
+            except Exception as error:  # A bad command ends neither the session nor the server
+                self.send(f"ERR The command {command} failed ({error!r})")
+            await self.writer.drain()
+
+
+    async def new_game(self, args: list[str]) -> None:
+        """
+        Start a new game. If the player plays B, the computer makes the first move.
+
+        Args:
+            args (list[str]): The side of the player (A or B) and the time limit of the computer in milliseconds.
+        """
+        side = args[0] if args else "A"
+        try:
+            budget = int(args[1]) if len(args) > 1 else self.server.budget
+        except ValueError:  # Not a number, e.g., "²", which is a digit that int does not accept
+            budget = 0
+        if side not in ("A", "B") or budget < 1:
+            self.send("ERR Usage: NEW [A|B] [ms] with ms >= 1")
+            return
+        self.budget = min(budget, self.server.max_budget)
+        self.game = GebetaGameState()
+        self.computer = 1 if side == "A" else 0
+        self.game.maximising = self.computer
+        self.send(f"OK New game. You are {side}. The computer searches {self.budget} ms per move.")
+        self.send_state()
+        await self.computer_moves()
+
+
+    async def move(self, args: list[str]) -> None:
+        """
+        Make the player's move and let the computer answer.
+
+        Args:
+            args (list[str]): The home A-F of the player's move.
+        """
+        if self.game is None or self.game.is_terminal():
+            self.send("ERR No game. Use NEW to start a game.")
+            return
+        if self.game.playerindex == self.computer:  # Cannot happen, because the computer moves before the next command is read
+            self.send("ERR It is the computer's turn.")
+            return
+        if len(args) != 1 or len(args[0]) != 1 or args[0] not in "ABCDEF" or not self.game.pit_not_empty(args[0]):
+            self.send("ERR Invalid move. Choose a home A-F that is not empty.")
+            return
+        self.game = self.game.take_action(Action(self.game.home_to_move(args[0])))
+        self.send_state()
+        if not self.check_end():
+            await self.computer_moves()
+
+
+    async def computer_moves(self) -> None:
+        """
+        Let the computer make its moves until it is the player's turn or the game ends.
+        """
+        while not self.closed and not self.game.is_terminal() and self.game.playerindex == self.computer:  # No search for a player who has left
+            start = time.perf_counter()
+            self.pending = self.server.engines.search(encode_status(self.game.board), self.computer, self.budget)
+            try:
+                home = await self.pending
+            except asyncio.CancelledError:
+                if self.closed:  # The player has left
+                    return
+                raise
+            except Exception as error:  # A failed search ends the game, but not the session
+                self.send(f"ERR The computer could not move ({error!r}). The game is aborted. Use NEW to start a game.")
+                self.game = None
+                return
+            finally:
+                self.pending = None
+            latency = (time.perf_counter() - start) * 1000
+            self.moves += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.game = self.game.take_action(Action(self.game.home_to_move(home)))
+            self.send(f"COMPUTER {home} {latency:.0f}")
+            self.send_state()
+            self.check_end()
+
+
+    def check_end(self) -> bool:
+        """
+        Send the result if the game has ended.
+
+        Returns:
+            bool: True if the game has ended.
+        """
+        if self.game.is_terminal():
+            self.send(f"END {self.game.moves[-1]}")
+            return True
+        return False
+
+
+    def send_stats(self) -> None:
+        """
+        Send the latency of the computer's moves and the load of the server.
+        """
+        mean = self.total_latency / self.moves if self.moves else 0.0
+        queue = self.server.engines.queue.qsize()
+        self.send(f"STATS moves={self.moves} mean_ms={mean:.0f} max_ms={self.max_latency:.0f} queue={queue} sessions={len(self.server.sessions)}")
+
+
+class GebetaServer:
+    """
+    An asyncio server that hosts many concurrent games against a shared pool of search workers.
+    """
+    def __init__(self, workers: int | None = None, budget: int = 1000, max_budget: int = 5000) -> None:
+        """
+        Create the server.
+
+        Args:
+            workers (int | None): The number of search worker processes. The default is the number of CPUs.
+            budget (int): The default time limit of the computer's search in milliseconds.
+            max_budget (int): The largest time limit that a player can choose.
+        """
+        if budget < 1 or max_budget < 1:
+            raise ValueError("The time limits must be at least 1 ms")
+        self.workers : int | None = workers
+        self.budget : int = min(budget, max_budget)
+        self.max_budget : int = max_budget
+        self.engines : EnginePool | None = None
+        self.sessions : set[Session] = set()
+
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Run a session for a new connection.
+        """
+        session = Session(self, reader, writer)
+        self.sessions.add(session)
+        try:
+            await session.run()
+        except ConnectionError:
+            pass  # The player disconnected
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, path: str | None = None) -> None:
+        """
+        Accept connections until the server is cancelled.
+
+        Args:
+            host (str): The host to listen on.
+            port (int): The TCP port to listen on.
+            path (str | None): The path of a Unix socket to listen on instead of TCP.
+        """
+        self.engines = EnginePool(self.workers)
+        self.engines.start()
+        if path:
+            server = await asyncio.start_unix_server(self.handle_client, path=path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"Gebeta server listening on {path or f'{host}:{port}'} with {self.engines.workers} search workers.")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.engines.stop()
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Command line interface for the server.
+
+    Args:
+        argv (list[str] | None): The command line arguments. The default is sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser(description="Host many Gebeta games against the computer.")
+    parser.add_argument("--host", default="127.0.0.1", help="host to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on")
+    parser.add_argument("--unix", default=None, help="path of a Unix socket to listen on instead of TCP")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of search worker processes (default: number of CPUs)")
+    parser.add_argument("-b", "--budget", type=int, default=1000, help="default search time per computer move in ms")
+    parser.add_argument("--max-budget", type=int, default=5000, help="largest search time per computer move that a player can choose")
+    args = parser.parse_args(argv)
+    if args.budget < 1 or args.max_budget < 1:
+        parser.error("the time limits must be at least 1 ms")
+
+    server = GebetaServer(args.workers, args.budget, args.max_budget)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()